@@ -11,36 +11,79 @@ the common tasks. The options are mostly self explanatory but there are also som
 examples and a brief overview in the README.md file in the bulk-service-actions
 package.
 """
+from __future__ import annotations
+
+import atexit
+import datetime
+import functools
+import hashlib
+import io
 import json
 import re
-import textwrap
 import time as epoch_time
 import os
 import sys
-from typing import List, Union, Dict
+from typing import (
+    TYPE_CHECKING,
+    BinaryIO,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    TextIO,
+    Tuple,
+    Union,
+)
 import click
-import requests
-import urllib3
 
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+if TYPE_CHECKING:
+    import requests
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+_SERVICE_TAG_RE = re.compile(r":([^{]*)\{")
+_KEYS_RE = re.compile(r"\{([^}]*)\}")
+_ISO_RE = re.compile(r"^\d{4}-\d{2}-\d{2}")
+_IN_TIME_RE = re.compile(r"^(\d+)h(\d+)m$")
+
+# Keypath prefixes for the <service-type>::<service-id> shorthand
+_PREFIXES = {
+    "5g-mbh": "/ncs:services/struct:bespoke/mobile-backhaul:mbh/service",
+    "cfs-l2-p2p": "/ncs:services/struct:bespoke/cfs-l2-p2p:cfs-l2-p2p/service",
+    "cfs-mp-2-mp": "/ncs:services/struct:bespoke/cfs-l2-p2p:cfs-mp-2-mp/service",
+    "sync-device": "/ncs:services/struct:network/cfs-network-sync:network-sync/device",
+    "sync-endpoint": (
+        "/ncs:services/struct:network/cfs-network-sync:network-sync/endpoint"
+    ),
+}
+_SERVICE_TYPES = frozenset(_PREFIXES)
 
 
-def require_env(variables) -> None:
+def require_env(variables) -> Dict[str, str]:
     """
-    Checks required environment variables
+    Checks required environment variables and returns their values, unchanged since
+    e.g. a password may contain leading or trailing whitespace
     """
-    env = os.environ
+    values = {x: os.environ.get(x, "") for x in variables}
 
-    missing = [x for x in variables if x not in env or env[x].strip() == ""]
+    missing = [x for x, value in values.items() if not value.strip()]
 
     if missing:
         print("The bsa-controller requires these environment variables to be set:")
 
-        for x in variables:
-            if x in missing:
-                print(f"[ ] {x}")
-            else:
+        for x in values:
+            if x not in missing:
                 print(f"[x] {x}")
+            else:
+                print(f"[ ] {x}")
 
         print(
             "\nNSO_URL should be in URL format with port, e.g.: https://127.0.0.1:8080"
@@ -48,23 +91,113 @@ def require_env(variables) -> None:
 
         sys.exit(1)
 
+    return values
+
+
+@functools.lru_cache(maxsize=None)
+def nso_env() -> Dict[str, str]:
+    """
+    Required environment variables, checked on first use rather than at import so that
+    e.g. --help works without them
+    """
+    env = require_env(["NSO_URL", "NSO_API_USER", "NSO_API_PASSWORD"])
+    env["NSO_URL"] = env["NSO_URL"].strip()
+    return env
+
+
+@functools.lru_cache(maxsize=None)
+def get_session() -> requests.Session:
+    """
+    Shared session so that all calls reuse pooled connections to NSO instead of setting
+    up a new TCP/TLS connection per request, sized so that every worker thread of
+    send_concurrently() gets its own connection. requests is only imported here since
+    it is the bulk of the startup time
+    """
+    # pylint: disable=import-outside-toplevel
+    import requests
+    import urllib3
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+    env = nso_env()
+    session = requests.Session()
+    session.auth = (env["NSO_API_USER"], env["NSO_API_PASSWORD"])
+    session.verify = False
+    session.headers.update(
+        {
+            "Accept": "application/yang-data+json",
+            "Content-Type": "application/yang-data+json",
+        }
+    )
+    adapter = HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=32,
+        max_retries=Retry(
+            total=3, backoff_factor=0.3, status_forcelist=[502, 503, 504]
+        ),
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    atexit.register(session.close)
+    return session
 
-require_env(["NSO_URL", "NSO_API_USER", "NSO_API_PASSWORD"])
 
-API_USER = os.environ.get("NSO_API_USER")
-API_PASSWORD = os.environ.get("NSO_API_PASSWORD")
-NSO_URL = os.environ.get("NSO_URL")
+# Local copy of the last service-list response, reused for SERVICES_CACHE_TTL seconds.
+# The list is operational data, which RESTCONF entity tags and last-modified
+# timestamps don't track, so the copy can only be expired by age
+CACHE_DIR = os.path.expanduser("~/.cache/bsa")
+SERVICES_CACHE_TTL = 30
+# Last scheduled activity, used to skip scheduling the same activity twice in a row
+LAST_ACTIVITY = os.path.join(CACHE_DIR, "last_activity.json")
+LAST_ACTIVITY_WINDOW = 600
+# Fewest services approve-diff fetches the service list for to skip duplicate diffs,
+# below this sending every approval costs less than fetching the whole list
+APPROVE_DEDUPE_MIN = 10
 
 
 class ControllerRun:
     """ControllerRun Class"""
 
-    def __init__(self, service_ids=None, input_file=None):
+    def __init__(self, service_ids=None, input_file=None, refresh=False):
+        self.refresh = refresh
         self.provided_services = False
         if any([service_ids, input_file]):
             self.provided_services = True
         self.service_paths = build_service_paths(service_ids, input_file)
-        self.service_list = send_request("get", "services")
+
+    @functools.cached_property
+    def service_list(self) -> BinaryIO:
+        """
+        Service list from NSO, only fetched for commands that actually read it
+        """
+        return fetch_service_list(self.refresh)
+
+    def iter_services(self) -> Iterator[Dict]:
+        """
+        Yields the entries of the service list one at a time. With ijson available the
+        body is parsed incrementally rather than loaded as a whole, otherwise it is
+        parsed in one go with orjson if available or json as a last resort
+        """
+        with self.service_list as file:
+            if ijson is not None:
+                try:
+                    yield from ijson.items(file, "bulk-service-actions:services.item")
+                except ijson.common.IncompleteJSONError as error:
+                    raise ValueError(
+                        f"Malformed response from server: {error}"
+                    ) from error
+                return
+            if orjson is not None:
+                service_list = orjson.loads(file.read())
+            else:
+                service_list = json.load(file)
+
+        services = service_list.get("bulk-service-actions:services")
+        if services is None:
+            raise ValueError(f"Malformed response from server. Got: {service_list}")
+        yield from services
 
 
 @click.group()
@@ -80,38 +213,49 @@ class ControllerRun:
     "input_file",
     help="Read services from file, one per line",
 )
+@click.option(
+    "-r",
+    "--refresh",
+    "refresh",
+    help="Fetch the service list from NSO even if a recently cached copy exists",
+    is_flag=True,
+)
 @click.pass_context
-def cli(ctx: ControllerRun, service_ids: str, input_file: str):
+def cli(ctx: ControllerRun, service_ids: str, input_file: str, refresh: bool):
     """
     Controller program for NSO bulk service actions
 
     Identify services either with keypath or in <service-type>::<service-id> format
     """
-    ctx.obj = ControllerRun(service_ids, input_file)
+    # the environment is checked by the first request rather than here, since click
+    # only handles a subcommand's --help after this callback has run
+    ctx.obj = ControllerRun(service_ids, input_file, refresh)
 
 
 # Utility functions
+def request_url(suffix: str, datastore: str = "data") -> str:
+    """
+    Returns the RESTCONF URL of the given path under /bulk-service-actions
+    """
+    root = f"/restconf/{datastore}/bulk-service-actions:bulk-service-actions/"
+    return f"{nso_env()['NSO_URL']}{root}{suffix}"
+
+
 def send_request(
-    method: str, suffix: str, body=None, datastore: str = "data"
+    method: str,
+    suffix: str,
+    body=None,
+    datastore: str = "data",
+    stream: bool = False,
 ) -> requests.Response:
     """
-    Reusable request function for fetching/posting data
+    Reusable request function for fetching/posting data. Anything but a GET can change
+    the service list, so the cached copy is dropped first
     """
-    root = f"/restconf/{datastore}/bulk-service-actions:bulk-service-actions/"
-    headers = {
-        "Accept": "application/yang-data+json",
-        "Content-Type": "application/yang-data+json",
-    }
-    url = f"{NSO_URL}{root}{suffix}"
-    call = {
-        "put": requests.put,
-        "post": requests.post,
-        "get": requests.get,
-        "patch": requests.patch,
-    }
-    response = call[method](
-        url, auth=(API_USER, API_PASSWORD), verify=False, headers=headers, json=body
-    )
+    if method != "get":
+        invalidate_cache()
+    url = request_url(suffix, datastore)
+    response = get_session().request(method.upper(), url, json=body, stream=stream)
     if response.status_code == 204 and method == "get":
         raise ValueError(
             "/bulk-service-actions/services is empty, "
@@ -120,49 +264,181 @@ def send_request(
     return response
 
 
+def send_concurrently(
+    method: str, suffix: str, bodies: List[Dict], max_workers: int = 16
+) -> List[requests.Response]:
+    """
+    Sends one request per body in parallel over the shared session, responses are
+    returned in the same order as the bodies
+    """
+    # pylint: disable-next=import-outside-toplevel
+    from concurrent.futures import ThreadPoolExecutor
+
+    # create the session up front rather than racing to do so in the workers
+    get_session()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(
+            executor.map(lambda body: send_request(method, suffix, body), bodies)
+        )
+
+
+def cache_paths() -> Tuple[str, str]:
+    """
+    Returns the paths of the cached service list and its metadata. The dry-runs in it
+    are only readable by the API user, so the copies are kept apart per NSO server and
+    API user
+    """
+    env = nso_env()
+    key = hashlib.blake2b(
+        f"{env['NSO_URL']}\n{env['NSO_API_USER']}".encode(), digest_size=16
+    ).hexdigest()
+    return (
+        os.path.join(CACHE_DIR, f"services-{key}.json"),
+        os.path.join(CACHE_DIR, f"services-{key}.meta"),
+    )
+
+
+def open_private(path: str, mode: str = "w") -> Union[BinaryIO, TextIO]:
+    """
+    Opens a file in CACHE_DIR for writing, creating both with permissions for the
+    current user only
+    """
+    os.makedirs(CACHE_DIR, mode=0o700, exist_ok=True)
+    # tighten permissions of a directory created by an earlier version as well
+    os.chmod(CACHE_DIR, 0o700)
+    descriptor = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    os.fchmod(descriptor, 0o600)
+    encoding = None if "b" in mode else "utf-8"
+    return os.fdopen(descriptor, mode, encoding=encoding)
+
+
+def read_cache_meta() -> Dict:
+    """
+    Returns metadata of the cached service list, or an empty dict if there is no usable
+    cache for the current NSO server and user
+    """
+    services_cache, services_meta = cache_paths()
+    try:
+        with open(services_meta, encoding="utf-8") as file:
+            meta = json.load(file)
+    except (OSError, ValueError):
+        return {}
+    if not os.path.exists(services_cache):
+        return {}
+    return meta
+
+
+def invalidate_cache() -> None:
+    """
+    Drops the metadata of the cached service list, so that the next read fetches it
+    """
+    try:
+        os.remove(cache_paths()[1])
+    except OSError:
+        pass
+
+
+def write_cache(response: requests.Response) -> BinaryIO:
+    """
+    Streams the service list response to disk along with the time it was fetched at,
+    and returns the stored body for reading
+    """
+    services_cache, services_meta = cache_paths()
+    # drop the old metadata first so a partially written body is never reused
+    invalidate_cache()
+    try:
+        file = open_private(services_cache, "wb")
+    # caching is best effort, fall back to keeping the body in memory
+    except OSError:
+        return io.BytesIO(response.content)
+
+    with file:
+        for chunk in response.iter_content(chunk_size=65536):
+            file.write(chunk)
+
+    meta = {"fetched-at": epoch_time.time()}
+    with open_private(services_meta) as file:
+        json.dump(meta, file)
+
+    return open(services_cache, "rb")  # pylint: disable=consider-using-with
+
+
+def activity_scheduled_recently(url: str, digest: str) -> bool:
+    """
+    Checks whether an identical activity was scheduled against the same URL within
+    LAST_ACTIVITY_WINDOW seconds
+    """
+    try:
+        with open(LAST_ACTIVITY, encoding="utf-8") as file:
+            last = json.load(file)
+    except (OSError, ValueError):
+        return False
+    return (
+        last.get("url") == url
+        and last.get("hash") == digest
+        and epoch_time.time() - last.get("ts", 0) < LAST_ACTIVITY_WINDOW
+    )
+
+
+def record_activity(url: str, digest: str) -> None:
+    """
+    Stores the URL and hash of the activity just scheduled
+    """
+    try:
+        with open_private(LAST_ACTIVITY) as file:
+            json.dump({"url": url, "hash": digest, "ts": epoch_time.time()}, file)
+    # best effort, only used to guard against accidental re-runs
+    except OSError:
+        pass
+
+
+def fetch_service_list(refresh: bool = False) -> BinaryIO:
+    """
+    Fetches the service list, reusing the copy cached by a previous invocation if it
+    is less than SERVICES_CACHE_TTL seconds old and refresh isn't set. Returns the body
+    as an open file so that it can be parsed incrementally
+    """
+    meta = {} if refresh else read_cache_meta()
+    if epoch_time.time() - meta.get("fetched-at", 0) < SERVICES_CACHE_TTL:
+        # pylint: disable-next=consider-using-with
+        return open(cache_paths()[0], "rb")
+
+    with send_request("get", "services", stream=True) as response:
+        if response.status_code != 200:
+            raise ValueError(
+                f"Request failed with {response.status_code}: {response.content}"
+            )
+        return write_cache(response)
+
+
+@functools.lru_cache(maxsize=8192)
 def create_keypath(service_id: str) -> str:
     """
     Takes either <service-type>::<service-id> or keypath and returns keypath (unchanged
     if given keypath)
     """
-    assert "::" in service_id or re.match(
-        "^\\/", service_id
-    ), "Please provide keypath or service-id in format <service_type>::<service_id>"
-
-    if re.match("^\\/", service_id):
+    if service_id.startswith("/"):
         return service_id
 
-    service_type = service_id.split("::")[0]
-    service_id = service_id.split("::")[1]
-    service_types = [
-        "5g-mbh",
-        "cfs-l2-p2p",
-        "cfs-mp-2-mp",
-        "sync-device",
-        "sync-endpoint",
-    ]
-    assert service_type in service_types, f"Service type must be one of {service_types}"
-    bespoke = "/ncs:services/struct:bespoke"
-    network = "/ncs:services/struct:network"
-    prefixes = {
-        "5g-mbh": f"{bespoke}/mobile-backhaul:mbh/service",
-        "cfs-l2-p2p": f"{bespoke}/cfs-l2-p2p:cfs-l2-p2p/service",
-        "cfs-mp-2-mp": f"{bespoke}/cfs-l2-p2p:cfs-mp-2-mp/service",
-        "sync-device": f"{network}/cfs-network-sync:network-sync/device",
-        "sync-endpoint": f"{network}/cfs-network-sync:network-sync/endpoint",
-    }
-    keypath = f"{prefixes[service_type]}{{{service_id}}}"
+    assert (
+        "::" in service_id
+    ), "Please provide keypath or service-id in format <service_type>::<service_id>"
+
+    service_type, _, service_id = service_id.partition("::")
+    prefix = _PREFIXES.get(service_type)
+    assert prefix is not None, f"Service type must be one of {sorted(_SERVICE_TYPES)}"
 
-    return keypath
+    return f"{prefix}{{{service_id}}}"
 
 
-def parse_service_ids(service_ids: Union[str, List]) -> List:
+def parse_service_ids(service_ids: Union[str, Iterable[str]]) -> List:
     """
-    Helper function to output a list of keypaths given either service IDs or keypaths
+    Helper function to output a list of keypaths given either service IDs or keypaths,
+    duplicates are dropped while keeping the input order
     """
     if isinstance(service_ids, str):
         service_ids = service_ids.split(",")
-    return [create_keypath(service_id) for service_id in service_ids]
+    return list(dict.fromkeys(map(create_keypath, service_ids)))
 
 
 def build_service_paths(
@@ -175,12 +451,30 @@ def build_service_paths(
         if service_ids is not None:
             return parse_service_ids(service_ids)
         if input_file is not None:
+            # read the file line by line, skipping blank lines
             with open(f"{input_file}", encoding="utf-8") as file:
-                service_ids = file.read().splitlines()
-                return parse_service_ids(service_ids)
+                return parse_service_ids(
+                    service_id for line in file if (service_id := line.strip())
+                )
     return []
 
 
+def offset_schedule(schedule: Dict[str, str], seconds: int) -> Dict[str, str]:
+    """
+    Returns the activity schedule moved the given number of seconds later. Relative
+    times only have minute precision, so the offset is rounded up to whole minutes
+    """
+    if "at-time" in schedule:
+        at_time = datetime.datetime.fromisoformat(schedule["at-time"])
+        return {"at-time": (at_time + datetime.timedelta(seconds=seconds)).isoformat()}
+
+    in_time = _IN_TIME_RE.match(schedule["in-time"])
+    if in_time is None:
+        raise ValueError("Relative time must be in the format of e.g. 6h15m")
+    minutes = int(in_time.group(1)) * 60 + int(in_time.group(2)) + (seconds + 59) // 60
+    return {"in-time": f"{minutes // 60:02d}h{minutes % 60:02d}m"}
+
+
 # Commands
 @cli.command()
 @click.argument(
@@ -205,54 +499,69 @@ def display(  # pylint: disable=too-many-statements
     click.echo("\n")
     common = ctx.obj
     service_paths = common.service_paths
+    service_path_set = frozenset(service_paths)
     provided_services = common.provided_services
-    service_list = json.loads(common.service_list.content)
+    services = common.iter_services()
+    # output is collected here and written in chunks rather than line by line
+    buffer = io.StringIO()
 
-    if "bulk-service-actions:services" not in service_list:
-        raise ValueError(f"Malformed response from server. Got: {service_list}")
+    def _write(text: str = "", **styles) -> None:
+        """
+        Helper function to add a line, styled with click.style() arguments, to the
+        output buffer
+        """
+        if styles:
+            text = click.style(text, **styles)
+        buffer.write(text)
+        buffer.write("\n")
+
+    def _flush() -> None:
+        """
+        Helper function to write out and empty the output buffer
+        """
+        click.echo(buffer.getvalue(), nl=False)
+        buffer.seek(0)
+        buffer.truncate()
 
     def _print_keypath(keypath) -> None:
         """
         Helper function to print the keypath where desired
         """
-        click.secho(keypath, fg="white")
+        _write(keypath, fg="white")
 
     def _display_modified_services(service: Dict[str, str]) -> None:
         """
         Helper function to display modified-services, called from _display_handler()
         """
-        if "modified-services" in service:
+        modified_services = service.get("modified-services")
+        if modified_services is not None:
             _print_keypath(service["keypath"])
-            click.secho("  +- modified services:", fg="magenta")
-            for modified_service in service["modified-services"]:
+            _write("  +- modified services:", fg="magenta")
+            for modified_service in modified_services:
                 service_block = modified_service["keypath"].split("/")[4]
-                service = re.search(":(.*){", service_block).group(1)
-                keys = re.search("{(.*)}", modified_service["keypath"]).group(1)
+                service = _SERVICE_TAG_RE.search(service_block).group(1)
+                keys = _KEYS_RE.search(modified_service["keypath"]).group(1)
                 key_list = keys.split()[:-1]
                 key_string = " ".join(str(key) for key in key_list)
-                click.secho(f"    +- {service} {key_string}", fg="bright_magenta")
+                _write(f"    +- {service} {key_string}", fg="bright_magenta")
                 if "dry-run" in modified_service:
                     _display_dry_run(
                         modified_service, indent="      ", supress_keypath=True
                     )
-                if "redeployed-at" in modified_service:
-                    click.secho(
-                        f"      +- redeployed at: {modified_service['redeployed-at']}",
-                        fg="cyan",
-                    )
-            click.echo("")
+                redeployed_at = modified_service.get("redeployed-at")
+                if redeployed_at is not None:
+                    _write(f"      +- redeployed at: {redeployed_at}", fg="cyan")
+            _write()
 
     def _display_errors(service: Dict[str, str]) -> None:
         """
         Helper function to display errors, called from _display_handler()
         """
-        if "last-redeploy-error" in service:
+        last_redeploy_error = service.get("last-redeploy-error")
+        if last_redeploy_error is not None:
             _print_keypath(service["keypath"])
-            click.secho(
-                f"  +- last redeploy error: \"{service['last-redeploy-error']}\"",
-                fg="red",
-            )
-            click.echo("")
+            _write(f'  +- last redeploy error: "{last_redeploy_error}"', fg="red")
+            _write()
 
     def _display_dry_run(
         service: Dict[str, str], indent: str = "  ", supress_keypath: bool = False
@@ -260,59 +569,52 @@ def display(  # pylint: disable=too-many-statements
         """
         Helper function to display dry-run, called from _display_handler()
         """
-        if "dry-run" in service:
-            if "output" in service["dry-run"]:
+        style = click.style
+        keypath = service["keypath"]
+        dry_run = service.get("dry-run")
+        if dry_run is not None:
+            fetched_at = dry_run.get("fetched-at")
+            output = dry_run.get("output")
+            last_redeploy_error = service.get("last-redeploy-error")
+            if output is not None:
                 if supress_keypath is False:
-                    _print_keypath(service["keypath"])
-                click.secho(f"{indent}+- dry-run", fg="cyan")
-                click.secho(f"{indent}  +- fetched at ", fg="cyan", nl=False)
-                click.secho(
-                    f"{service['dry-run']['fetched-at']}",
-                    fg="yellow",
-                )
-                click.secho(
-                    f"{indent}  +- output",
-                    fg="cyan",
+                    _print_keypath(keypath)
+                _write(f"{indent}+- dry-run", fg="cyan")
+                _write(
+                    style(f"{indent}  +- fetched at ", fg="cyan")
+                    + style(f"{fetched_at}", fg="yellow")
                 )
-                for device in service["dry-run"]["output"]:
-                    click.secho(
-                        f"{indent}    +- {device['device']}:", fg="red", bold=True
-                    )
-                    click.secho(
-                        f"{textwrap.indent(device['output'], f'{indent}      ')}",
+                _write(f"{indent}  +- output", fg="cyan")
+                pad = f"{indent}      "
+                for device in output:
+                    _write(f"{indent}    +- {device['device']}:", fg="red", bold=True)
+                    _write(
+                        pad + device["output"].replace("\n", "\n" + pad),
                         fg="bright_blue",
                     )
-            elif "last-redeploy-error" in service:
-                click.secho(
-                    f"{indent}  +- no diff: \"{service['last-redeploy-error']}\"",
-                    fg="red",
-                )
-                click.echo("")
+            elif last_redeploy_error is not None:
+                _write(f'{indent}  +- no diff: "{last_redeploy_error}"', fg="red")
+                _write()
             else:
                 if output_filter != "diff-only":
                     if supress_keypath is False:
-                        _print_keypath(service["keypath"])
-                    click.secho(f"{indent}+- dry-run", fg="cyan")
-                    click.secho(f"{indent}  +- fetched at ", fg="cyan", nl=False)
-                    click.secho(
-                        f"{service['dry-run']['fetched-at']}",
-                        fg="yellow",
+                        _print_keypath(keypath)
+                    _write(f"{indent}+- dry-run", fg="cyan")
+                    _write(
+                        style(f"{indent}  +- fetched at ", fg="cyan")
+                        + style(f"{fetched_at}", fg="yellow")
                     )
-                    click.secho(
-                        f"{indent}  +- no diff",
-                        fg="green",
-                        bold=True,
-                    )
-                    click.echo("")
+                    _write(f"{indent}  +- no diff", fg="green", bold=True)
+                    _write()
         else:
             if provided_services:
                 if supress_keypath is False:
-                    _print_keypath(service["keypath"])
-                click.secho(
+                    _print_keypath(keypath)
+                _write(
                     f"{indent}  +- no dry-run output, has a dry-run been performed?",
                     fg="red",
                 )
-                click.echo("")
+                _write()
 
     def _display_determiner(service: str) -> bool:
         """
@@ -343,11 +645,10 @@ def display(  # pylint: disable=too-many-statements
             if display_item is None:
                 _print_keypath(service["keypath"])
                 if "redeploy-ready" in service:
-                    click.secho("  +- service is ready for redeploy!", fg="bright_cyan")
-                if "redeployed-at" in service:
-                    click.secho(
-                        f"  +- redeployed at: {service['redeployed-at']}", fg="cyan"
-                    )
+                    _write("  +- service is ready for redeploy!", fg="bright_cyan")
+                redeployed_at = service.get("redeployed-at")
+                if redeployed_at is not None:
+                    _write(f"  +- redeployed at: {redeployed_at}", fg="cyan")
             if display_item == "dry-run":
                 _display_dry_run(service)
             if display_item == "modified-services":
@@ -355,42 +656,77 @@ def display(  # pylint: disable=too-many-statements
             if display_item == "errors":
                 _display_errors(service)
             if display_item is None and output_filter is None:
-                click.echo("")
+                _write()
 
     # Main function clause which calls _display_handler()
     if service_paths == []:
-        for service in service_list["bulk-service-actions:services"]:
-            _display_handler(service)
+        # pylint: disable-next=unnecessary-lambda-assignment
+        predicate = lambda keypath: True
     else:
-        for service in service_list["bulk-service-actions:services"]:
-            if service["keypath"] in service_paths:
+        predicate = service_path_set.__contains__
+    # write out what was collected even if a later service fails
+    try:
+        for index, service in enumerate(services, start=1):
+            if predicate(service["keypath"]):
                 _display_handler(service)
+            # write out every 100 services so long lists still show progress
+            if index % 100 == 0:
+                _flush()
+    finally:
+        _flush()
 
 
 @cli.command()
 @click.pass_context
 def approve_diff(ctx: ControllerRun) -> None:
     """
-    Approve the dry-run diff of a given service
+    Approve the dry-run diff of one or more services, when given many services those
+    whose diffs were all approved along with an earlier service are skipped
     """
     common = ctx.obj
     service_paths = common.service_paths
-    assert len(service_paths) == 1, "Approve diff command requires exactly one service"
-    service = service_paths[0]
+    assert len(service_paths) > 0, "Approve diff command requires at least one service"
     suffix = "service-list-tools"
-    json_input = {"diff-approval": {"approve-diff": service}}
-    json_dump = json.dumps(json_input)
-    json_object = json.loads(json_dump)
-
-    result = send_request("post", suffix, json_object)
-    if result.status_code != 204:
-        raise ValueError(f"Request failed with {result.status_code}")
-
-    click.secho(
-        f"Dry-run from {service} added to approved-diffs list!",
-        fg="green",
-        bold=True,
-    )
+    # services often share identical diffs, look them up so that each distinct diff
+    # is only approved once
+    diffs = {}
+    if len(service_paths) >= APPROVE_DEDUPE_MIN:
+        service_path_set = frozenset(service_paths)
+        diffs = {
+            service["keypath"]: frozenset(
+                device["output"]
+                for device in service.get("dry-run", {}).get("output", [])
+            )
+            for service in common.iter_services()
+            if service["keypath"] in service_path_set
+        }
+
+    # requests are sent one after another, each one commits the approved diffs and
+    # concurrent commits creating the same diffs would conflict
+    approved = set()
+    failed = []
+    for service in service_paths:
+        service_diffs = diffs.get(service)
+        if service_diffs and service_diffs <= approved:
+            click.secho(
+                f"Dry-run from {service} already approved with a previous service, "
+                "skipping",
+                fg="yellow",
+            )
+            continue
+        json_input = {"diff-approval": {"approve-diff": service}}
+        result = send_request("post", suffix, json_input)
+        if result.status_code != 204:
+            failed.append(f"{service} ({result.status_code})")
+            continue
+        approved.update(service_diffs or ())
+        click.secho(
+            f"Dry-run from {service} added to approved-diffs list!",
+            fg="green",
+            bold=True,
+        )
+    if failed:
+        raise ValueError(f"Request failed for {', '.join(failed)}")
 
 
 @cli.command()
@@ -417,10 +753,7 @@ def edit_service_list(ctx: ControllerRun, action: str) -> None:
         json_input = {"redeploy-ready": {"operation": "remove", "targets": targets}}
     if action == "clear":
         json_input = {"clear": {"targets": targets}}
-    json_dump = json.dumps(json_input)
-    json_object = json.loads(json_dump)
-
-    result = send_request("post", suffix, json_object)
+    result = send_request("post", suffix, json_input)
     if result.status_code != 204:
         raise ValueError(f"Request failed with {result.status_code}")
 
@@ -485,8 +818,25 @@ def edit_service_list(ctx: ControllerRun, action: str) -> None:
         ]
     ),
 )
+@click.option(
+    "-b",
+    "--batch-size",
+    help="Split given services into activities of this many services each, the "
+    "activities are sent concurrently and each one starts once the previous one is "
+    "done, so services are still acted on one per interval",
+    required=False,
+    type=click.IntRange(min=1),
+    default=None,
+)
+@click.option(
+    "--force",
+    help="Schedule even if an identical activity was scheduled in the last "
+    f"{LAST_ACTIVITY_WINDOW // 60} minutes",
+    required=False,
+    is_flag=True,
+)
 @click.pass_context
-def schedule_redeploy(
+def schedule_redeploy(  # pylint: disable=too-many-arguments,too-many-locals
     ctx: ControllerRun,
     dry_run_false: bool,
     no_networking: bool,
@@ -494,6 +844,8 @@ def schedule_redeploy(
     interval: int = 30,
     action: str = "redeploy-top-level",
     subset_of_all: str = None,
+    batch_size: int = None,
+    force: bool = False,
 ) -> None:
     """
     Schedule a redeploy/reconcile activity
@@ -527,7 +879,7 @@ def schedule_redeploy(
         schedule = {"in-time": "00h01m"}
         message = "1 minute from now"
     # schedule to given time if supplied time is ISO
-    elif re.match("^\\d{4}-\\d{2}-\\d{2}", time):
+    elif _ISO_RE.match(time):
         schedule = {"at-time": time}
         message = time
     # schedule relative if supplied time is offset
@@ -535,6 +887,36 @@ def schedule_redeploy(
         schedule = {"in-time": time}
         message = f"in {time} from now"
 
+    if subset_of_all is not None:
+        targets = {"subset-of-all": {subset_of_all: [None]}}
+    elif service_paths == []:
+        targets = {"all": [None]}
+    else:
+        targets = {"keypath": service_paths}
+
+    suffix = "activity"
+    url = request_url(suffix)
+    # the activity name contains a timestamp so it is left out of the hash
+    fingerprint = {
+        "action": action,
+        "targets": targets,
+        "commit-flags": {"dry-run": dry_run, "no-networking": no_networking},
+        "interval": interval,
+        "schedule": schedule,
+        "batch-size": batch_size,
+    }
+    digest = hashlib.blake2b(
+        json.dumps(fingerprint, sort_keys=True).encode(), digest_size=16
+    ).hexdigest()
+    if not force and activity_scheduled_recently(url, digest):
+        click.secho(
+            "Skipping, an identical activity was already scheduled, use --force to "
+            "schedule it anyway",
+            fg="yellow",
+            bold=True,
+        )
+        return
+
     if not click.confirm(
         f"Scheduling a {action} action with dry-run {dry_run} and "
         f"no-networking {no_networking} for {message}. Confirm?"
@@ -545,46 +927,68 @@ def schedule_redeploy(
             bold=True,
         )
         return
-    suffix = "activity"
 
-    epoch = re.match("^(.*)\\.", str(epoch_time.time())).group(1)
+    epoch = str(int(epoch_time.time()))
     activity_name = f"bsa-controller_{action}_{epoch}"
 
-    if subset_of_all is not None:
-        targets = {"subset-of-all": {subset_of_all: [None]}}
-    elif service_paths == []:
-        targets = {"all": [None]}
+    def _service_def(name: str, targets: Dict, schedule: Dict) -> Dict:
+        """
+        Helper function to build the activity payload
+        """
+        return {
+            "bulk-service-actions:activity": [
+                {
+                    "name": name,
+                    "action": {action: [None]},
+                    "targets": targets,
+                    "commit-flags": {
+                        "dry-run": dry_run,
+                        "no-networking": no_networking,
+                    },
+                    "interval": interval,
+                    "schedule": schedule,
+                }
+            ]
+        }
+
+    if batch_size is not None and len(service_paths) > batch_size:
+        activity_names = []
+        service_defs = []
+        for index, start in enumerate(range(0, len(service_paths), batch_size)):
+            batch_name = f"{activity_name}_{index}"
+            batch_targets = {"keypath": service_paths[start : start + batch_size]}
+            # start after the services of the previous batches, otherwise NSO would
+            # run one redeploy per batch in parallel every interval
+            batch_schedule = offset_schedule(schedule, start * int(interval))
+            activity_names.append(batch_name)
+            service_defs.append(_service_def(batch_name, batch_targets, batch_schedule))
+        results = send_concurrently("patch", suffix, service_defs)
     else:
-        targets = {"keypath": service_paths}
-
-    service_def = {
-        "bulk-service-actions:activity": [
-            {
-                "name": activity_name,
-                "action": {action: [None]},
-                "targets": targets,
-                "commit-flags": {
-                    "dry-run": dry_run,
-                    "no-networking": no_networking,
-                },
-                "interval": interval,
-                "schedule": schedule,
-            }
+        activity_names = [activity_name]
+        results = [
+            send_request(
+                "patch", suffix, _service_def(activity_name, targets, schedule)
+            )
         ]
-    }
-    service_def_dump = json.dumps(service_def)
-    service_def_object = json.loads(service_def_dump)
-
-    result = send_request("patch", suffix, service_def_object)
-    if result.status_code != 204:
-        raise ValueError(f"Request failed with {result.status_code}: {result.content}")
 
-    click.secho(
-        f"Activity {activity_name} scheduled! See /bulk-service-actions/activity "
-        "for details",
-        fg="green",
-        bold=True,
-    )
+    # batches are sent together, so report the ones that were created before failing
+    created = []
+    failed = []
+    for name, result in zip(activity_names, results):
+        if result.status_code != 204:
+            failed.append(f"{name} ({result.status_code}: {result.content})")
+        else:
+            created.append(name)
+    if created:
+        record_activity(url, digest)
+        click.secho(
+            f"Activity {', '.join(created)} scheduled! See "
+            "/bulk-service-actions/activity for details",
+            fg="green",
+            bold=True,
+        )
+    if failed:
+        raise ValueError(f"Request failed for {', '.join(failed)}")
 
 
 if __name__ == "__main__":
@@ -1,8 +1,20 @@
 # -*- mode: python; python-indent: 4 -*-
 """ Implementation of Services and Actions """
-from typing import Dict, Set, cast, Literal
+from typing import (
+    Callable,
+    Dict,
+    FrozenSet,
+    List,
+    NamedTuple,
+    Optional,
+    Pattern,
+    Tuple,
+    Union,
+    cast,
+)
 import re
 import datetime
+import functools
 import ncs
 from ncs.application import Service
 from ncs.dp import Action
@@ -10,38 +22,74 @@ import _ncs
 
 PropList = List[Tuple[str, str]]
 
+# Relative schedule time, e.g. 06h15m
+_IN_TIME_RE = re.compile(r"(?:(?P<h>\d+)h)?\s*(?:(?P<m>\d+)m)?")
+
+# Configured wildcards, each compiled on its own along with its replacement
+Wildcards = Tuple[Tuple[Pattern, str], ...]
+
+
 def str_to_bool(bool_str: str) -> bool:
     """
     Used for converting string boolean values like "true" used inside NSO to actual
     booleans
     """
-    if bool_str.casefold() == "true":
-        return True
+    return bool_str.lower() == "true"
 
-    return False
 
+@functools.lru_cache(maxsize=8)
+def compile_wildcards(wildcards: Tuple[str, ...]) -> Wildcards:
+    """
+    Compiles each wildcard separately so that they are applied one after the other,
+    a later wildcard can match text substituted by an earlier one and every wildcard
+    keeps its own inline flags. Cached so patterns are only compiled again after the
+    configured wildcards change
+    """
+    return tuple(
+        (re.compile(wildcard), f"*WILDCARD{index+1}*")
+        for index, wildcard in enumerate(wildcards)
+    )
 
-def parse_dry_run(dry_run: str) -> str:
+
+def load_wildcards(root: ncs.maagic.Root) -> Wildcards:
+    """
+    Returns the configured wildcards compiled, empty if there are none
+    """
+    return compile_wildcards(
+        tuple(
+            str(wildcard)
+            for wildcard in root.bulk_service_actions.settings.diff_checking.wildcard
+        )
+    )
+
+
+def parse_dry_run(
+    dry_run: str, root: ncs.maagic.Root = None, wildcards: Wildcards = None
+) -> str:
     """
     Simple function to format dry-run output
     Currently only swaps out wildcards, could be expanded to do more
+
+    Pass wildcards already loaded with load_wildcards(), or root of an already open
+    transaction to load them from, to avoid starting a new transaction per call
     """
-    with ncs.maapi.single_read_trans(
-        user="admin", context="system", groups=["system"]
-    ) as transaction:
-        root = ncs.maagic.get_root(transaction)
-        wildcards = root.bulk_service_actions.settings.diff_checking.wildcard
-        return_output = dry_run
-        if len(wildcards) > 0:
-            for index, wildcard in enumerate(wildcards):
-                return_output = re.sub(
-                    rf"{wildcard}", f"*WILDCARD{index+1}*", return_output
-                )
+    if wildcards is None:
+        if root is None:
+            with ncs.maapi.single_read_trans(
+                user="admin", context="system", groups=["system"]
+            ) as transaction:
+                wildcards = load_wildcards(ncs.maagic.get_root(transaction))
+        else:
+            wildcards = load_wildcards(root)
 
-        return return_output
+    for pattern, replacement in wildcards:
+        dry_run = pattern.sub(replacement, dry_run)
+    return dry_run
 
 
-def build_service_set(node: ncs.maagic.Node) -> Set[str]:
+def build_service_set(
+    node: ncs.maagic.Node, ordered: bool = False
+) -> Union[FrozenSet[str], Tuple[str, ...]]:
     """
     Shared logic tree for building set of services to act on:
 
@@ -52,91 +100,186 @@ def build_service_set(node: ncs.maagic.Node) -> Set[str]:
 
     subset-of-all gives the user the ability to select all services with a particular
     flag
+
+    If ordered is set the keypaths are returned as a sorted tuple, for callers that
+    need a deterministic iteration order
     """
 
-    def should_include_service(
-        service: ncs.maagic.Node, subset: ncs.maagic.Container
-    ) -> bool:
-        """helper function to include desired subsets of services"""
-        if subset.last_redeploy_error and service.last_redeploy_error:
-            return True
+    def make_predicate(
+        subset: ncs.maagic.Container,
+    ) -> Callable[[ncs.maagic.Node], bool]:
+        """
+        helper function to include desired subsets of services, the subset flags are
+        read once and only the checks for enabled flags are run per service
+        """
+        predicates = []
+        if subset.last_redeploy_error:
+            predicates.append(lambda service: bool(service.last_redeploy_error))
 
-        if subset.no_dry_run_diff and len(service.dry_run.output) == 0:
-            return True
+        if subset.no_dry_run_diff:
+            predicates.append(lambda service: len(service.dry_run.output) == 0)
 
-        if subset.no_dry_run_fetched_at and not service.dry_run.fetched_at:
-            return True
+        if subset.no_dry_run_fetched_at:
+            predicates.append(lambda service: not service.dry_run.fetched_at)
 
-        if subset.no_redeployed_at and not service.redeployed_at:
-            return True
+        if subset.no_redeployed_at:
+            predicates.append(lambda service: not service.redeployed_at)
 
-        if subset.redeployed_at and service.redeployed_at:
-            return True
+        if subset.redeployed_at:
+            predicates.append(lambda service: bool(service.redeployed_at))
 
-        if subset.redeploy_ready and service.redeploy_ready:
-            return True
+        if subset.redeploy_ready:
+            predicates.append(lambda service: bool(service.redeploy_ready))
 
-        return False
+        return lambda service: any(predicate(service) for predicate in predicates)
 
     with ncs.maapi.single_read_trans(
         user="admin", context="system", groups=["system"]
     ) as transaction:
         root = ncs.maagic.get_root(transaction)
 
-        if len(root.bulk_service_actions.services) == 0:
-            raise AttributeError("Please run service-list populate action first!")
-
-        all_services = set(
-            service.keypath for service in root.bulk_service_actions.services
+        # keys are read through a maapi cursor, without wrapping each entry in a
+        # maagic node
+        all_services = frozenset(
+            str(keys[0])
+            for keys in transaction.cursor(
+                "/bulk-service-actions:bulk-service-actions/services"
+            )
         )
+        if not all_services:
+            raise AttributeError("Please run service-list populate action first!")
 
         # if no targets specified then act on all
         if not node.targets:
-            return all_services
-
-        if node.targets.all:
+            service_set = all_services
+        elif node.targets.all:
             # if subset-of-all then return desired subset
             if node.targets.all.subset:
-                subset = node.targets.all.subset
-                return set(
+                predicate = make_predicate(node.targets.all.subset)
+                service_set = frozenset(
                     service.keypath
                     for service in root.bulk_service_actions.services
-                    if should_include_service(service, subset)
+                    if predicate(service)
                 )
-            if node.targets.keypath:
+            elif node.targets.keypath:
                 # branch for keypath as exclude
-                return set(all_services) - set(list(node.targets.keypath))
-            # branch for all
-            return all_services
+                service_set = all_services - frozenset(node.targets.keypath)
+            else:
+                # branch for all
+                service_set = all_services
+        else:
+            # branch for keypath as include
+            service_set = frozenset(node.targets.keypath)
+
+    if ordered:
+        return tuple(sorted(service_set))
+    return service_set
+
+
+def get_service_node(
+    root: ncs.maagic.Root, keypath: str, parent_cache: Dict[str, ncs.maagic.Node]
+) -> ncs.maagic.Node:
+    """
+    Resolves a service keypath to its maagic node. The list node of the previous lookup
+    is kept in parent_cache, so consecutive keypaths in the same list (as when iterating
+    over sorted keypaths) are looked up in that list instead of walking from root again.
+    Keypaths that can't be split that way, e.g. with braces inside a key, are resolved
+    from root
+    """
+    index = keypath.rfind("{")
+    if index <= 0 or not keypath.endswith("}"):
+        return ncs.maagic.get_node(root, keypath)
+
+    parent_path = keypath[:index]
+    # a brace inside the last key leaves the braces of the parent path unbalanced
+    if parent_path.count("{") != parent_path.count("}"):
+        return ncs.maagic.get_node(root, keypath)
 
-        # branch for keypath as include
-        return set(list(node.targets.keypath))
+    try:
+        parent = parent_cache.get(parent_path)
+        if parent is None:
+            parent_cache.clear()
+            parent = parent_cache[parent_path] = ncs.maagic.get_node(root, parent_path)
+        return parent[keypath[index:]]
+    except (_ncs.error.Error, KeyError, ValueError):
+        return ncs.maagic.get_node(root, keypath)
+
+
+def _reset_flags(
+    transaction: ncs.maapi.Transaction, keypath: str, flags: Tuple[str, ...]
+) -> None:
+    """
+    Deletes the given flags below keypath where they are set, directly through maapi
+    rather than through maagic nodes
+    """
+    for flag in flags:
+        flag_path = f"{keypath}/{flag}"
+        if transaction.exists(flag_path):
+            transaction.delete(flag_path)
 
 
 def able_to_redeploy(
-    dry_run: bool,
-    service: ncs.maagic.Node,
-    calling_class: Literal["ResolveTopLevel", "ReconcileSublayers"],
+    dry_run: bool, service: ncs.maagic.Node, is_reconcile: bool
 ) -> bool:
-    """Helper function to determine if the requested service can be redeployed"""
-    if not dry_run:
-        if service.redeploy_ready:
-            return True
-        if calling_class == "ReconcileSublayers" and service.redeployed_at:
-            return True
+    """
+    Helper function to determine if the requested service can be redeployed, the
+    service flags are only read when needed
+    """
+    if dry_run:
+        return True
+    if service.redeploy_ready:
+        return True
+    return is_reconcile and bool(service.redeployed_at)
+
 
-        return False
+def enabled_input_flags(commit_flags: Dict[str, bool]) -> Tuple[str, ...]:
+    """
+    Names of the re-deploy action inputs to create for the given commit flags, these
+    are the same for every service of a bulk action so they only need to be built once
+    """
+    return tuple(
+        flag.replace("-", "_")
+        for flag in ("dry-run", "reconcile", "no-networking")
+        if commit_flags[flag]
+    )
 
-    return True
+
+class RedeployBatch(NamedTuple):
+    """
+    Values shared by all redeploys of one bulk action, built once per action
+    """
+
+    time_now: str
+    input_flags: Tuple[str, ...]
+    wildcards: Wildcards
+    approved_diffs: Optional[FrozenSet[str]] = None
+
+    @classmethod
+    def start(
+        cls,
+        root: ncs.maagic.Root,
+        commit_flags: Dict[str, bool],
+        approved_diffs: FrozenSet[str] = None,
+    ) -> "RedeployBatch":
+        """
+        Batch timestamped with the current time for the given commit flags, with the
+        wildcards configured under root
+        """
+        return cls(
+            datetime.datetime.now().isoformat(),
+            enabled_input_flags(commit_flags),
+            load_wildcards(root),
+            approved_diffs,
+        )
 
 
 def redeploy(
     node: ncs.maagic.Node,
     service: ncs.maagic.Node,
     commit_flags: Dict[str, bool],
-    output: Set[str],
-    approved_diffs: ncs.maagic.List = None,
-) -> Set[str]:
+    output: Dict[str, None],
+    batch: RedeployBatch = None,
+) -> Dict[str, None]:
     """
     Shared redeploy function for redeploy-top-level and reconcile-sublayers. It's a bit
     ugly since it needs to accommodate a variety of behaviors while using the maagic
@@ -145,22 +288,20 @@ def redeploy(
     Args:
         node: Maagic node of service to redeploy/reconcile
         service: Entry in /bulk-service-actions/services(/modified-services) for service
-        approved_diffs:
         commit_flags: dict of boolean commit flags
-        output: Set of output parameters
-        approved_diffs: Object containing the approved diffs configured
+        output: Output messages, a dict is used as an insertion ordered set
+        batch: Values shared by the bulk action, started for this call if not given
     Returns:
-        Output set
+        Output messages
     """
 
     def _dry_run_true(service: ncs.maagic.Node) -> None:
         """Non reconcile dry-run method"""
 
         # clear flags from previous run
-        if service.redeploy_ready:
-            del service.redeploy_ready
-        if service.last_redeploy_error:
-            del service.last_redeploy_error
+        _reset_flags(
+            transaction, service_path, ("redeploy-ready", "last-redeploy-error")
+        )
         # if no diff mark as redeploy ready
         if len(result.native.device) == 0:
             service.redeploy_ready.create()
@@ -173,43 +314,44 @@ def redeploy(
     def _dry_run_true_common(service: ncs.maagic.Node) -> None:
         """Dry-run operations common to reconcile and non-reconcile"""
 
-        # populate/overwrite dry-run output in service list
-        if service.dry_run:
-            del service.dry_run
-        # delete redeployed-at flag from previous non dry-run execution
-        if service.redeployed_at:
-            del service.redeployed_at
+        # populate/overwrite dry-run output in service list and delete redeployed-at
+        # flag from previous non dry-run execution
+        _reset_flags(transaction, service_path, ("dry-run", "redeployed-at"))
         service.dry_run.create()
         service.dry_run.fetched_at = time_now
         for device in result.native.device:
             service.dry_run.output.create(device.name)
-            service.dry_run.output[device.name].output = parse_dry_run(device.data)
+            service.dry_run.output[device.name].output = parse_dry_run(
+                device.data, wildcards=wildcards
+            )
 
     def _dry_run_false(service: ncs.maagic.Node) -> None:
         """Non dry-run method"""
 
         service.redeployed_at = time_now
-        if service.last_redeploy_error:
-            del service.last_redeploy_error
-        if service.dry_run:
-            del service.dry_run
+        flags = ("last-redeploy-error", "dry-run")
         if not commit_flags["reconcile"]:
-            del service.redeploy_ready
+            flags += ("redeploy-ready",)
+        _reset_flags(transaction, service_path, flags)
 
     def _set_inputs(node: ncs.maagic.Node) -> ncs.maagic.ActionParams:
         """Set inputs method"""
         service_redeploy = node.re_deploy
         inputs = cast(ncs.maagic.ActionParams, service_redeploy.get_input())
+        for flag in input_flags:
+            getattr(inputs, flag).create()
         if commit_flags["dry-run"]:
-            inputs.dry_run.create()
             inputs.dry_run.outformat = "native"
-        if commit_flags["reconcile"]:
-            inputs.reconcile.create()
-        if commit_flags["no-networking"]:
-            inputs.no_networking.create()
         return inputs
 
-    time_now = datetime.datetime.now().isoformat()
+    if batch is None:
+        batch = RedeployBatch.start(ncs.maagic.get_root(service), commit_flags)
+    time_now = batch.time_now
+    input_flags = batch.input_flags
+    wildcards = batch.wildcards
+    approved_diffs = batch.approved_diffs
+    transaction = ncs.maagic.get_trans(service)
+    service_path = service._path
 
     # create redeploy inputs
     inputs = _set_inputs(node)
@@ -227,7 +369,7 @@ def redeploy(
             _dry_run_false(service)
     except _ncs.error.Error as error:
         service.last_redeploy_error = error
-        output.add("There were errors during one or more redeploys")
+        output["There were errors during one or more redeploys"] = None
 
     return output
 
@@ -261,37 +403,39 @@ class BulkServiceActionScheduler(Service):
             if schedule.at_time:
                 schedule_time = datetime.datetime.fromisoformat(schedule.at_time)
             if schedule.in_time:
-                hours_re = re.search("(\\d+)h", schedule.in_time)
-                assert hours_re is not None
-                hours = int(hours_re.group(1))
-                minute_re = re.search("(\\d+)m", schedule.in_time)
-                assert minute_re is not None
-                minutes = int(minute_re.group(1))
+                in_time = _IN_TIME_RE.match(schedule.in_time)
+                assert in_time.group("h") is not None
+                assert in_time.group("m") is not None
                 schedule_time = time_now + datetime.timedelta(
-                    hours=hours, minutes=minutes
+                    hours=int(in_time.group("h")), minutes=int(in_time.group("m"))
                 )
 
             if schedule_time < time_now:
                 raise ValueError("Please specify a scheduled time in the future")
-            for index, to_schedule in enumerate(build_service_set(service)):
-                dry_run = str(service.commit_flags.dry_run).lower()
-                no_networking = str(service.commit_flags.no_networking).lower()
-                xml_params = f"""<commit-flags>
-                                    <dry-run>{dry_run}</dry-run>
-                                    <no-networking>{no_networking}</no-networking>
-                                </commit-flags>
-                                <targets>
-                                    <keypath>{to_schedule}</keypath>
-                                </targets>"""
-                delay_seconds = index * service.interval
-                task = root.scheduler.task.create(
-                    f"bulk-service-action-scheduler_{action_name}_{to_schedule}"
-                )
-                task.action_name = f"{action_name}"
+            dry_run = str(service.commit_flags.dry_run).lower()
+            no_networking = str(service.commit_flags.no_networking).lower()
+            interval = int(service.interval)
+            task_prefix = f"bulk-service-action-scheduler_{action_name}_"
+            # only the keypath differs between tasks, so the params around it are
+            # built once and concatenated per task
+            xml_prefix = f"""<commit-flags>
+                                <dry-run>{dry_run}</dry-run>
+                                <no-networking>{no_networking}</no-networking>
+                            </commit-flags>
+                            <targets>
+                                <keypath>"""
+            xml_suffix = """</keypath>
+                            </targets>"""
+            for index, to_schedule in enumerate(
+                build_service_set(service, ordered=True)
+            ):
+                delay_seconds = index * interval
+                task = root.scheduler.task.create(task_prefix + to_schedule)
+                task.action_name = action_name
                 task.action_node = "/bulk-service-actions"
-                task.action_params = xml_params
+                task.action_params = xml_prefix + to_schedule + xml_suffix
                 task.time = datetime.datetime.isoformat(
-                    schedule_time + datetime.timedelta(seconds=int(delay_seconds))
+                    schedule_time + datetime.timedelta(seconds=delay_seconds)
                 )
 
 
@@ -351,15 +495,17 @@ class ServiceList(Action):
             user="admin", context="system", groups=["system"]
         ) as transaction:
             root = ncs.maagic.get_root(transaction)
+            services = root.bulk_service_actions.services
             clear_set = build_service_set(action_input.clear)
             # normal deletion through _clear() doesn't seem to work, so this is a
             # crude workaround to delete the whole list if the lengths are equal
-            if len(clear_set) == len(root.bulk_service_actions.services):
+            if len(clear_set) == len(services):
                 del root.bulk_service_actions.services
                 return f"Cleared services {clear_set} from service list"
 
-            for to_clear in clear_set:
-                del root.bulk_service_actions.services[to_clear]
+            # delete in key order so consecutive deletes hit neighbouring entries
+            for to_clear in sorted(clear_set):
+                del services[to_clear]
             self.log.info(f"Cleared {clear_set} from service list")
 
             transaction.apply()
@@ -370,60 +516,56 @@ class ServiceList(Action):
         """
         Function to populate the service list
         """
-        with ncs.maapi.single_read_trans(
+        with ncs.maapi.start_write_trans(
             user="admin", context="system", groups=["system"]
         ) as transaction:
             root = ncs.maagic.get_root(transaction)
+            settings = root.bulk_service_actions.settings
 
             # Service types fetched from settings in following format, e.g.
             # /services/path/to/my/service
-            paths = root.bulk_service_actions.settings.service_list.top_level_types
+            paths = settings.service_list.top_level_types
             if len(paths) == 0:
                 return (
                     "ERROR: No services defined at /bulk-service-actions/settings/"
                     "service-list/top-level-types"
                 )
 
-            service_list = [
-                service._path
-                for path in paths
-                for service in ncs.maagic.get_node(root, path)
-            ]
-
-        with ncs.maapi.start_write_trans(
-            user="admin", context="system", groups=["system"]
-        ) as transaction:
-            root = ncs.maagic.get_root(transaction)
-            settings = root.bulk_service_actions.settings
-            for service in service_list:
-                # create main list entry
-                action_services = root.bulk_service_actions.services
-                action_services.create(service)
-
-                # populate modified service list
-                service_node = ncs.maagic.get_node(root, service)
-                try:
-                    modified_services = service_node.modified.services
-                    target_sublayers = settings.service_list.target_sublayers
-                    services_to_reconcile = [
-                        str(modified_service)
-                        for modified_service in modified_services
-                        if any(
-                            target in str(modified_service)
-                            for target in target_sublayers
-                        )
-                    ]
-                # if attempting to show the service operational data on the CLI gives
-                # "internal error" then we get python error "Transaction not found (61)"
-                # a redeploy of the CFS usually fixes this
-                except _ncs.error.Error:
-                    services_to_reconcile = [
-                        "Service operational data corrupt, please redeploy CFS first"
-                    ]
-                for service_to_reconcile in services_to_reconcile:
-                    action_services[service].modified_services.create(
-                        service_to_reconcile
-                    )
+            target_sublayers = tuple(
+                str(target) for target in settings.service_list.target_sublayers
+            )
+            # one alternation of all targets so each modified service is scanned once,
+            # without targets nothing may match so fall back to a never matching pattern
+            sublayer_re = re.compile(
+                "|".join(re.escape(target) for target in target_sublayers)
+                if target_sublayers
+                else r"(?!)"
+            )
+            action_services = root.bulk_service_actions.services
+            # walk each top-level service once, reading its modified services while
+            # the node is already resolved
+            for path in paths:
+                for service_node in ncs.maagic.get_node(root, path):
+                    # create main list entry
+                    service = action_services.create(service_node._path)
+
+                    # populate modified service list
+                    try:
+                        services_to_reconcile = [
+                            modified_str
+                            for modified_service in service_node.modified.services
+                            if sublayer_re.search(modified_str := str(modified_service))
+                        ]
+                    # if attempting to show the service operational data on the CLI
+                    # gives "internal error" then we get python error "Transaction not
+                    # found (61)" a redeploy of the CFS usually fixes this
+                    except _ncs.error.Error:
+                        services_to_reconcile = [
+                            "Service operational data corrupt, please redeploy CFS "
+                            "first"
+                        ]
+                    for service_to_reconcile in services_to_reconcile:
+                        service.modified_services.create(service_to_reconcile)
 
             transaction.apply()
 
@@ -451,23 +593,25 @@ class RedeployTopLevel(Action):
         self.log.info(f"Action {name}")
 
         # Get list of services to redeploy from inputs
-        change_set = build_service_set(action_input)
+        change_set = build_service_set(action_input, ordered=True)
 
-        # Define output as set which can be appended to for different branches below
-        output = set()
-        output.add(
+        # Define output as dict (an ordered set) which can be appended to for different
+        # branches below
+        output = {
             "redeploy-top-level action called with dry-run "
             f"{action_input.commit_flags.dry_run} and no-networking "
-            f"{action_input.commit_flags.no_networking} for service(s) {change_set}"
-        )
+            f"{action_input.commit_flags.no_networking} for service(s) "
+            f"{change_set}": None
+        }
 
         with ncs.maapi.start_write_trans(
             user="admin", context="system", groups=["system"]
         ) as transaction:
             root = ncs.maagic.get_root(transaction)
-            output.add("See /bulk-service-actions/services for output")
-            if len(root.bulk_service_actions.services) == 0:
-                output = set("Please run populate-service-list action first!")
+            services = root.bulk_service_actions.services
+            output["See /bulk-service-actions/services for output"] = None
+            if len(services) == 0:
+                output = {"Please run populate-service-list action first!": None}
 
             commit_flags = {
                 "dry-run": str_to_bool(action_input.commit_flags.dry_run),
@@ -475,22 +619,27 @@ class RedeployTopLevel(Action):
                 "reconcile": False,
             }
 
-            approved_diffs = root.bulk_service_actions.approved_diffs
+            # approved diffs are only checked on reconcile dry-runs, so none are
+            # loaded for a top-level redeploy
+            batch = RedeployBatch.start(root, commit_flags)
+            dry_run = commit_flags["dry-run"]
+            parent_cache = {}
             for to_change in change_set:
-                service = root.bulk_service_actions.services[to_change]
-                node = ncs.maagic.get_node(root, service.keypath)
+                service = services[to_change]
                 # skip services not ready for redeploy
-                if not able_to_redeploy(commit_flags["dry-run"], service, self.__class__.__name__):
+                if not able_to_redeploy(dry_run, service, is_reconcile=False):
                     service.last_redeploy_error = (
                         f"Service {service.keypath} not "
                         "flagged as redeploy-ready, skipping"
                     )
-                    output.add("Redeploy-ready not set for one or more services")
+                    output["Redeploy-ready not set for one or more services"] = None
                     continue
+                node = get_service_node(root, service.keypath, parent_cache)
 
-                output = redeploy(node, service, commit_flags, output, approved_diffs)
+                output = redeploy(node, service, commit_flags, output, batch)
 
             transaction.apply()
+            output = "\n".join(output)
             self.log.info(f"Action {name} - output: {output}")
             action_output.output = output
 
@@ -516,14 +665,15 @@ class ReconcileSublayers(Action):
         self.log.info(f"Action {name}")
 
         # Get list of services to redeploy from inputs
-        change_set = build_service_set(action_input)
-        # Define output as set which can be appended to for different branches below
-        output = set()
-        output.add(
+        change_set = build_service_set(action_input, ordered=True)
+        # Define output as dict (an ordered set) which can be appended to for different
+        # branches below
+        output = {
             "reconcile-sublayers action called with dry-run "
             f"{action_input.commit_flags.dry_run} and no-networking "
-            f"{action_input.commit_flags.no_networking} for service(s) {change_set}"
-        )
+            f"{action_input.commit_flags.no_networking} for service(s) "
+            f"{change_set}": None
+        }
 
         with ncs.maapi.start_write_trans(
             user="admin", context="system", groups=["system"]
@@ -534,22 +684,32 @@ class ReconcileSublayers(Action):
                 "no-networking": str_to_bool(action_input.commit_flags.no_networking),
                 "reconcile": True,
             }
+            services = root.bulk_service_actions.services
+            parent_cache = {}
+            batch = RedeployBatch.start(root, commit_flags)
+            dry_run = commit_flags["dry-run"]
             for to_change in change_set:
-                service = root.bulk_service_actions.services[to_change]
+                service = services[to_change]
+                # readiness depends only on the top-level service, so check it once
+                ready = able_to_redeploy(dry_run, service, is_reconcile=True)
                 for modified_service in service.modified_services:
                     # skip services not ready for redeploy
-                    class_name = self.__class__.__name__
-                    if not able_to_redeploy(commit_flags["dry-run"], service, class_name):
+                    if not ready:
                         modified_service.last_redeploy_error = (
                             f"Service {service.keypath} not "
                             "flagged as redeploy-ready or not yet redeployed, skipping"
                         )
-                        output.add("Redeploy-ready not set for one or more services")
+                        output["Redeploy-ready not set for one or more services"] = None
                         continue
-                    node = ncs.maagic.get_node(root, modified_service.keypath)
-                    output = redeploy(node, modified_service, commit_flags, output)
+                    node = get_service_node(
+                        root, modified_service.keypath, parent_cache
+                    )
+                    output = redeploy(
+                        node, modified_service, commit_flags, output, batch
+                    )
 
             transaction.apply()
+            output = "\n".join(output)
             self.log.info(f"Action {name} - output: {output}")
             action_output.output = output
 
@@ -577,12 +737,14 @@ class ServiceListTools(Action):
             Adds redeploy-ready flag to given services
             """
             change_set = build_service_set(inputs)
+            add = inputs.operation == "add"
             for to_change in change_set:
-                if inputs.operation == "add":
-                    services[to_change].redeploy_ready.create()
+                service = services[to_change]
+                if add:
+                    service.redeploy_ready.create()
                 else:
-                    if services[to_change].redeploy_ready:
-                        del services[to_change].redeploy_ready
+                    if service.redeploy_ready:
+                        del service.redeploy_ready
             self.log.info(f"Marking {change_set} as redeploy-ready")
 
         def _diff_approval(
@@ -596,23 +758,27 @@ class ServiceListTools(Action):
             # approve a single diff
             if inputs.approve_diff:
                 target = action_input.diff_approval.approve_diff
-                if len(services[target].dry_run.output) == 0:
+                dry_run_output = services[target].dry_run.output
+                if len(dry_run_output) == 0:
                     self.log.info(f"{target} has no diff, skipping")
-                for device in services[target].dry_run.output:
+                for device in dry_run_output:
                     self.log.info(f"Adding {device.output} to approved-diffs")
-                    approved_diffs.create(parse_dry_run(device.output))
+                    approved_diffs.create(
+                        parse_dry_run(device.output, wildcards=wildcards)
+                    )
             # crosscheck all existing diffs with approved diffs
             if inputs.check_approvals:
+                approved_set = frozenset(
+                    approved_diff.diff for approved_diff in approved_diffs
+                )
                 for service in services:
-                    if len(service.dry_run.output) > 0:
-                        if all(
-                            (device.output in approved_diffs)
-                            for device in service.dry_run.output
-                        ):
-                            self.log.info(
-                                f"Marking {service.keypath} as redeploy-ready"
-                            )
-                            service.redeploy_ready.create()
+                    # read the outputs once instead of checking length and iterating
+                    outputs = [str(device.output) for device in service.dry_run.output]
+                    if not outputs:
+                        continue
+                    if all(output in approved_set for output in outputs):
+                        self.log.info(f"Marking {service.keypath} as redeploy-ready")
+                        service.redeploy_ready.create()
 
         def _wildcards(
             inputs: ncs.maagic.Node,
@@ -623,17 +789,27 @@ class ServiceListTools(Action):
             Allows for updating and rolling back diff wildcards
             """
             if inputs.operation == "update":
+                # nothing would be substituted without any configured wildcards
+                if not wildcards:
+                    self.log.info("No wildcards configured, skipping update")
+                    return
                 self.log.info("Updating wildcards in dry-runs and approved diffs")
                 for approved_diff in approved_diffs:
-                    if parse_dry_run(approved_diff.diff) != approved_diff.diff:
-                        approved_diffs.create(parse_dry_run(approved_diff.diff))
+                    diff = approved_diff.diff
+                    new_diff = parse_dry_run(diff, wildcards=wildcards)
+                    if new_diff != diff:
+                        approved_diffs.create(new_diff)
                 for service in services:
                     for device in service.dry_run.output:
-                        device.output = parse_dry_run(device.output)
+                        device.output = parse_dry_run(
+                            device.output, wildcards=wildcards
+                        )
             if inputs.operation == "rollback":
                 self.log.info("Rolling back dry-runs to original values")
                 for service in services:
                     dry_run = service.dry_run
+                    if not dry_run:
+                        continue
                     for device in dry_run.output:
                         device.output = dry_run.unaltered_output[device.device].output
 
@@ -643,6 +819,8 @@ class ServiceListTools(Action):
             root = ncs.maagic.get_root(transaction)
             approved_diffs = root.bulk_service_actions.approved_diffs
             services = root.bulk_service_actions.services
+            # loaded once for all the dry-runs and diffs handled by this action
+            wildcards = load_wildcards(root)
             # redeploy-ready logic
             if action_input.redeploy_ready:
                 inputs = action_input.redeploy_ready
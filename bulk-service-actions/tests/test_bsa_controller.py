@@ -0,0 +1,208 @@
+"""Tests for the bsa-controller command line"""
+import io
+import json
+import os
+import sys
+import types
+
+import pytest
+from click.testing import CliRunner
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import bsa_controller  # pylint: disable=wrong-import-position
+
+
+@pytest.mark.parametrize(
+    "args",
+    [
+        ["--help"],
+        ["display", "--help"],
+        ["approve-diff", "--help"],
+        ["edit-service-list", "--help"],
+        ["schedule-redeploy", "--help"],
+    ],
+)
+def test_help_without_environment(monkeypatch, args):
+    """--help works for the group and every command without the NSO variables set"""
+    for variable in ("NSO_URL", "NSO_API_USER", "NSO_API_PASSWORD"):
+        monkeypatch.delenv(variable, raising=False)
+    bsa_controller.nso_env.cache_clear()
+
+    result = CliRunner().invoke(bsa_controller.cli, args)
+
+    assert result.exit_code == 0, result.output
+    assert "Usage:" in result.output
+
+
+def test_command_without_environment(monkeypatch):
+    """Commands that talk to NSO still exit with the missing variables listed"""
+    for variable in ("NSO_URL", "NSO_API_USER", "NSO_API_PASSWORD"):
+        monkeypatch.delenv(variable, raising=False)
+    bsa_controller.nso_env.cache_clear()
+
+    result = CliRunner().invoke(bsa_controller.cli, ["display"])
+
+    assert result.exit_code == 1
+    assert "[ ] NSO_URL" in result.output
+
+
+def test_display_flushes_output_on_error(monkeypatch):
+    """Services displayed before a failing one are still written out"""
+    service_list = {
+        "bulk-service-actions:services": [
+            {"keypath": "/services/a{1}", "last-redeploy-error": "boom"},
+            {"no-keypath": None},
+        ]
+    }
+    monkeypatch.setattr(
+        bsa_controller,
+        "fetch_service_list",
+        lambda refresh=False: io.BytesIO(json.dumps(service_list).encode()),
+    )
+
+    result = CliRunner().invoke(bsa_controller.cli, ["display", "errors"])
+
+    assert isinstance(result.exception, KeyError)
+    assert 'last redeploy error: "boom"' in result.output
+
+
+class FakeResponse:
+    """Streamed response of the service list"""
+
+    status_code = 200
+
+    def __init__(self, body):
+        self.content = body
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def iter_content(self, chunk_size):
+        """Yields the body in chunks like requests does"""
+        for start in range(0, len(self.content), chunk_size):
+            yield self.content[start : start + chunk_size]
+
+
+@pytest.fixture(name="clock")
+def fixture_clock(monkeypatch, tmp_path):
+    """Private cache directory for one NSO server and a clock set by the test"""
+    monkeypatch.setenv("NSO_URL", "http://nso.example:8080")
+    monkeypatch.setenv("NSO_API_USER", "admin")
+    monkeypatch.setenv("NSO_API_PASSWORD", "admin")
+    bsa_controller.nso_env.cache_clear()
+    monkeypatch.setattr(bsa_controller, "CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(
+        bsa_controller, "LAST_ACTIVITY", str(tmp_path / "last_activity.json")
+    )
+    now = types.SimpleNamespace(value=1000.0)
+    monkeypatch.setattr(
+        bsa_controller, "epoch_time", types.SimpleNamespace(time=lambda: now.value)
+    )
+    yield now
+    bsa_controller.nso_env.cache_clear()
+
+
+def test_parse_service_ids_drops_duplicates():
+    """Service IDs and keypaths of the same service are only kept once, in order"""
+    keypath = "/ncs:services/struct:bespoke/mobile-backhaul:mbh/service{A}"
+
+    service_paths = bsa_controller.parse_service_ids(
+        f"5g-mbh::A,/x{{B}},{keypath},5g-mbh::A,/x{{B}}"
+    )
+
+    assert service_paths == [keypath, "/x{B}"]
+
+
+def test_create_keypath_rejects_unknown_service_type():
+    """Unknown service types are reported rather than cached as a keypath"""
+    with pytest.raises(AssertionError, match="Service type must be one of"):
+        bsa_controller.create_keypath("unknown::A")
+
+
+@pytest.mark.parametrize(
+    "schedule,seconds,expected",
+    [
+        ({"in-time": "00h01m"}, 0, {"in-time": "00h01m"}),
+        ({"in-time": "00h01m"}, 30, {"in-time": "00h02m"}),
+        ({"in-time": "00h01m"}, 60, {"in-time": "00h02m"}),
+        ({"in-time": "6h15m"}, 3000, {"in-time": "07h05m"}),
+        (
+            {"at-time": "2024-01-01T23:59:30"},
+            90,
+            {"at-time": "2024-01-02T00:01:00"},
+        ),
+    ],
+)
+def test_offset_schedule(schedule, seconds, expected):
+    """Relative times are rounded up to whole minutes, absolute ones are exact"""
+    assert bsa_controller.offset_schedule(schedule, seconds) == expected
+
+
+def test_offset_schedule_invalid_in_time():
+    """Relative times without minutes can't be offset"""
+    with pytest.raises(ValueError, match="6h15m"):
+        bsa_controller.offset_schedule({"in-time": "6h"}, 30)
+
+
+def test_service_list_cache_expires(monkeypatch, clock):
+    """The cached service list is reused until it is SERVICES_CACHE_TTL seconds old"""
+    requests_sent = []
+
+    def _send_request(method, suffix, body=None, datastore="data", stream=False):
+        requests_sent.append((method, suffix))
+        return FakeResponse(f"body {len(requests_sent)}".encode())
+
+    monkeypatch.setattr(bsa_controller, "send_request", _send_request)
+
+    with bsa_controller.fetch_service_list() as file:
+        assert file.read() == b"body 1"
+    clock.value += bsa_controller.SERVICES_CACHE_TTL - 1
+    with bsa_controller.fetch_service_list() as file:
+        assert file.read() == b"body 1"
+    clock.value += 1
+    with bsa_controller.fetch_service_list() as file:
+        assert file.read() == b"body 2"
+    with bsa_controller.fetch_service_list(refresh=True) as file:
+        assert file.read() == b"body 3"
+
+    assert requests_sent == [("get", "services")] * 3
+
+
+def test_invalidate_cache(monkeypatch, clock):
+    """An invalidated service list is fetched again even within the TTL"""
+    bodies = iter([b"old", b"new"])
+    monkeypatch.setattr(
+        bsa_controller,
+        "send_request",
+        lambda *args, **kwargs: FakeResponse(next(bodies)),
+    )
+
+    with bsa_controller.fetch_service_list() as file:
+        assert file.read() == b"old"
+    assert bsa_controller.read_cache_meta() == {"fetched-at": clock.value}
+    bsa_controller.invalidate_cache()
+
+    assert bsa_controller.read_cache_meta() == {}
+    with bsa_controller.fetch_service_list() as file:
+        assert file.read() == b"new"
+
+
+def test_activity_guard_window(clock):
+    """Only the same activity against the same URL within the window is a repeat"""
+    url = bsa_controller.request_url("activity")
+    assert not bsa_controller.activity_scheduled_recently(url, "digest")
+
+    bsa_controller.record_activity(url, "digest")
+
+    assert bsa_controller.activity_scheduled_recently(url, "digest")
+    assert not bsa_controller.activity_scheduled_recently(url, "other")
+    assert not bsa_controller.activity_scheduled_recently(
+        bsa_controller.request_url("activity", "operations"), "digest"
+    )
+    clock.value += bsa_controller.LAST_ACTIVITY_WINDOW - 1
+    assert bsa_controller.activity_scheduled_recently(url, "digest")
+    clock.value += 1
+    assert not bsa_controller.activity_scheduled_recently(url, "digest")
@@ -0,0 +1,36 @@
+"""Tests for the bulk-service-actions package, these need the NSO Python API"""
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("ncs")
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(PACKAGE_DIR, "python"))
+# pylint: disable-next=wrong-import-position
+from tnso_bulk_service_actions.bulk_service_actions import (
+    compile_wildcards,
+    parse_dry_run,
+)
+
+
+def test_wildcards_applied_in_order():
+    """A later wildcard can match text substituted by an earlier one"""
+    wildcards = compile_wildcards((r"\d+", "WILDCARD"))
+
+    assert parse_dry_run("desc 123", wildcards=wildcards) == "desc **WILDCARD2*1*"
+
+
+def test_wildcard_with_inline_flags():
+    """Inline global flags of a wildcard apply to that wildcard only"""
+    wildcards = compile_wildcards(("(?i)gigabitethernet", r"vlan \d+"))
+
+    assert (
+        parse_dry_run("GigabitEthernet0/0 VLAN 10 vlan 20", wildcards=wildcards)
+        == "*WILDCARD1*0/0 VLAN 10 *WILDCARD2*"
+    )
+
+
+def test_no_wildcards():
+    """Without wildcards the dry-run is returned unchanged"""
+    assert parse_dry_run("desc 123", wildcards=compile_wildcards(())) == "desc 123"